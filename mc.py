@@ -6,127 +6,279 @@ https://chatgpt.com/share/68e14257-6a60-8007-84e7-e3f390e1edc7
 
 import os
 import json
+import time
+import fcntl
+import atexit
 import random
-import threading
+import select
+import functools
 import subprocess
 import argparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # build LUT_VALUES: numbers 0..1023 but skip any that have digit '2' in base-4 (length 243)
-LUT_VALUES = []
-for n in range(0, 1024):
-    x = n
-    has_two = False
-    for _ in range(5):
-        if x % 4 == 2:
-            has_two = True
-            break
-        x //= 4
-    if not has_two:
-        LUT_VALUES.append(n)
+_n = np.arange(1024)
+_digits = np.stack([(_n >> (2 * k)) & 3 for k in range(5)])
+LUT_VALUES = _n[~(_digits == 2).any(axis=0)].tolist()
 assert len(LUT_VALUES) == 3 ** 5 == 243
 
-# Global best (protected by lock)
-best_holes = [i for i in range(13)]
-best_holes_lock = threading.Lock()
+# the values never change, so format them for the generated Verilog once
+LUT_STRS = ["{:03x}".format(v) for v in LUT_VALUES]
+
+# Per-process best. Workers are separate processes, so each keeps its own
+# in-memory best; best_holes.txt is the shared record, serialized with flock.
+best_holes = bytes(range(13))
 best_holes_filename = "best_holes.txt"
 global_best_score = None
 
-# memh directory
-MEMH_DIR = "memh_files"
+# Cross-process best score, set by main() via the pool initializer. Workers
+# read it without the lock to decide whether logging is even worth it.
+_SHARED_BEST_INIT = 2 ** 62
+_shared_best = None
+
+# Cross-process score cache (Manager dict), also set via the initializer.
+# Workers explore overlapping neighborhoods, so scores one worker computed
+# are worth a proxy round-trip to the others -- far cheaper than yosys.
+_shared_scores = None
+
+
+def _init_mc_worker(shared_best, shared_scores):
+    """Pool initializer: hand each monte_carlo worker the shared state proxies."""
+    global _shared_best, _shared_scores
+    _shared_best = shared_best
+    _shared_scores = shared_scores
+
+
+# memh directory: prefer tmpfs so the thousands of small memh/stat writes
+# never touch the SSD; override with MEMH_DIR=... to keep them persistent
+MEMH_DIR = os.environ.get(
+    "MEMH_DIR", "/dev/shm/memh_files" if os.path.isdir("/dev/shm") else "memh_files"
+)
 os.makedirs(MEMH_DIR, exist_ok=True)
 
+# Long-lived yosys shell, one per worker process. Spawning yosys per
+# evaluation costs more than the synthesis itself on a 256-entry LUT.
+_yosys_proc = None
+_yosys_job_id = 0
+
+# Per-job deadline in seconds. A healthy synth of this LUT takes well under a
+# second; a stuck one used to stall its worker for a full minute.
+YOSYS_TIMEOUT = 5.0
+
+
+def _ensure_yosys():
+    """Return the worker's yosys shell, (re)spawning it if needed."""
+    global _yosys_proc
+    if _yosys_proc is None or _yosys_proc.poll() is not None:
+        _yosys_proc = subprocess.Popen(
+            ["yosys"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    return _yosys_proc
 
-def _basename_for_holes(holes):
-    return "_".join(map(str, holes))
+
+def _shutdown_yosys():
+    global _yosys_proc
+    if _yosys_proc is not None and _yosys_proc.poll() is None:
+        try:
+            _yosys_proc.stdin.write(b"exit\n")
+            _yosys_proc.stdin.flush()
+        except Exception:
+            _yosys_proc.kill()
+        _yosys_proc.wait()
+    _yosys_proc = None
+
+
+atexit.register(_shutdown_yosys)
+
+# Nested pool used to evaluate the 13 candidates of a pass concurrently.
+# Created lazily so each monte_carlo worker process gets its own.
+_eval_pool = None
 
 
-def _memh_path_for_holes(holes):
-    return os.path.join(MEMH_DIR, _basename_for_holes(holes) + ".memh")
+def _reset_eval_worker():
+    """Initializer for eval-pool children: never reuse the parent's yosys pipes."""
+    global _yosys_proc
+    _yosys_proc = None
+
+
+def _get_eval_pool():
+    global _eval_pool
+    if _eval_pool is None:
+        _eval_pool = ProcessPoolExecutor(max_workers=13, initializer=_reset_eval_worker)
+    return _eval_pool
+
+
+def _shutdown_eval_pool():
+    """Tear down the nested eval pool; a live one keeps the worker from exiting."""
+    global _eval_pool
+    if _eval_pool is not None:
+        _eval_pool.shutdown()
+        _eval_pool = None
+
+
+def _run_yosys(cmds):
+    """
+    Feed newline-separated commands to the persistent yosys shell and wait
+    until its sentinel log line comes back or YOSYS_TIMEOUT expires. Returns
+    True on completion, False if the shell died or got stuck (either way it
+    is killed and respawned on the next call).
+    """
+    global _yosys_job_id
+    _yosys_job_id += 1
+    sentinel = f"__DONE__{_yosys_job_id}".encode()
+    proc = _ensure_yosys()
+    try:
+        proc.stdin.write(cmds.encode() + b"\nlog " + sentinel + b"\n")
+        proc.stdin.flush()
+        # scan the chatty synth output as raw bytes; nothing but the sentinel
+        # is ever inspected, so don't pay to decode or accumulate it
+        deadline = time.monotonic() + YOSYS_TIMEOUT
+        fd = proc.stdout.fileno()
+        tail = b""
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                break  # stuck job: kill the shell rather than wait it out
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                return False  # EOF: the shell died on its own
+            tail += chunk
+            if sentinel in tail:
+                return True
+            tail = tail[-(len(sentinel) - 1):]
+    except Exception:
+        pass
+    proc.kill()
+    proc.wait()
+    return False
+
+
+def _basename_for_holes(holes):
+    return "_".join(map(str, holes))
 
 
 def _stat_path_for_holes(holes):
     return os.path.join(MEMH_DIR, _basename_for_holes(holes) + ".stat.json")
 
 
+def _read_num_cells(stat_path):
+    """Parse modules->"\lut"->num_cells out of a stat json. Returns int or None."""
+    try:
+        with open(stat_path, "rb") as fh:
+            raw = fh.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except Exception:
+        return None
+    num_cells = data.get("modules", {}).get("\\lut", {}).get("num_cells")
+    return num_cells if isinstance(num_cells, int) else None
+
+
 def get_utilization(holes):
     """
-    Read memh_files/<basename>.stat.json modules->"\lut"->num_cells if present.
-    Otherwise write memh_files/<basename>.memh (with 'xxx' in hole slots), run yosys,
-    and then read the stat file. Returns int or None.
+    Score `holes` via yosys. Checks the in-memory LRU first, then the on-disk
+    stat.json cache, and only synthesizes on a full miss. Returns int or None.
+    """
+    if __debug__:
+        if not holes or len(holes) != 13:
+            raise ValueError("holes must be a list of 13 integers")
+    return _get_utilization_cached(bytes(sorted(holes)))
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def _get_utilization_cached(holes):
     """
-    if not holes or len(holes) != 13:
-        raise ValueError("holes must be a list of 13 integers")
+    Read <MEMH_DIR>/<basename>.stat.json modules->"\lut"->num_cells if present.
+    Otherwise feed yosys an inline copy of lut.v with the LUT contents ('x' in
+    hole slots) baked into the initial block, and read the stat file it tees.
+    Returns int or None.
+    """
+    # scores other workers already computed, before touching the filesystem
+    if _shared_scores is not None:
+        num_cells = _shared_scores.get(holes)
+        if num_cells is not None:
+            return num_cells
 
     stat_path = _stat_path_for_holes(holes)
 
     # try to read existing stat json
     if os.path.exists(stat_path):
-        try:
-            with open(stat_path, "r") as fh:
-                data = json.load(fh)
-            num_cells = data.get("modules", {}).get("\\lut", {}).get("num_cells")
-            if isinstance(num_cells, int):
-                return num_cells
-        except Exception:
-            pass  # fall through to regenerate
-
-    # build full LUT: insert 'xxx' at hole indices
+        num_cells = _read_num_cells(stat_path)
+        if num_cells is not None:
+            if _shared_scores is not None:
+                _shared_scores[holes] = num_cells
+            return num_cells
+        # fall through to regenerate
+
+    # build full LUT as preformatted hex strings, inserting 'xxx' at hole
+    # indices (holes is sorted, so a single merge-walk pointer beats building
+    # a set and hashing 256 ints)
     full = []
-    lut_iter = iter(LUT_VALUES)
-    hole_set = set(holes)
+    lut_iter = iter(LUT_STRS)
+    h_idx = 0
     for i in range(256):
-        if i in hole_set:
+        if h_idx < 13 and holes[h_idx] == i:
             full.append("xxx")
+            h_idx += 1
         else:
             full.append(next(lut_iter))
-    assert len(full) == 256
-
-    # write memh file
-    memh_path = _memh_path_for_holes(holes)
-    with open(memh_path, "w") as fh:
-        for val in full:
-            if val == "xxx":
-                fh.write("xxx\n")
-            else:
-                fh.write("{:03x}\n".format(int(val)))
-
-    # yosys commands (write stat json into memh_files)
+
+    # inline copy of lut.v with the memh contents baked into the initial
+    # block, so yosys never has to open a file ('hxxx is all-x, like the
+    # old 'xxx' memh lines)
+    mem_init = "\n".join(f"    mem[{i}] = 10'h{val};" for i, val in enumerate(full))
+    design_src = (
+        "module lut (\n"
+        "    input [7:0] a,\n"
+        "    output [9:0] b\n"
+        ");\n"
+        "reg [9:0] mem [0:255];\n"
+        "initial begin\n"
+        f"{mem_init}\n"
+        "end\n"
+        "assign b = mem[a];\n"
+        "endmodule\n"
+    )
+
+    # yosys commands (write stat json into MEMH_DIR); design -reset clears
+    # the shell for the next job
     yosys_cmds = (
-        f'read_verilog -DMEMH_FILENAME="{memh_path}" lut.v; '
-        "synth; "
-        "opt -full; "
-        "aigmap; "
-        "opt -full; "
-        f'tee -o "{stat_path}" stat -json'
+        "read_verilog <<EOF\n"
+        f"{design_src}"
+        "EOF\n"
+        "synth\n"
+        "opt -full\n"
+        "aigmap\n"
+        "opt -full\n"
+        f'tee -o "{stat_path}" stat -json\n'
+        "design -reset"
     )
 
-    try:
-        subprocess.run(
-            ["yosys", "-p", yosys_cmds],
-            text=True,
-            capture_output=True,
-            timeout=60,
-        )
-    except Exception:
+    if not _run_yosys(yosys_cmds):
         return None
 
     if os.path.exists(stat_path):
-        try:
-            with open(stat_path, "r") as fh:
-                data = json.load(fh)
-            num_cells = data.get("modules", {}).get("\\lut", {}).get("num_cells")
-            if isinstance(num_cells, int):
-                return num_cells
-        except Exception:
-            return None
+        num_cells = _read_num_cells(stat_path)
+        if num_cells is not None and _shared_scores is not None:
+            _shared_scores[holes] = num_cells
+        return num_cells
 
     return None
 
 
 def change_hole(holes, index):
     """
-    Return a new holes list copy where only holes[index] is changed.
+    Return a new sorted holes bytes where only holes[index] is changed.
     Move it to a new random location strictly between neighbors.
     For edges, left is -1 and right is 256.
     Ensure a change when possible.
@@ -138,40 +290,51 @@ def change_hole(holes, index):
     left = holes[index - 1] if index > 0 else -1
     right = holes[index + 1] if index < len(holes) - 1 else 256
 
-    possible = list(range(left + 1, right))
-    if not possible:
-        return holes.copy()
+    span = right - left - 1  # number of open slots, including old's
+    if span <= 1:
+        return holes  # old is the only slot; no move possible
 
-    if len(possible) == 1:
-        new_val = possible[0]
-    else:
-        new_val = old
-        tries = 0
-        while new_val == old and tries < 20:
-            new_val = random.choice(possible)
-            tries += 1
+    # draw uniformly from the span-1 slots that aren't old
+    new_val = left + 1 + random.randrange(span - 1)
+    if new_val >= old:
+        new_val += 1
 
-    new_holes = holes.copy()
-    new_holes[index] = new_val
-    return sorted(new_holes)
+    # holes is already sorted; splice in new_val and re-sort the 13 bytes
+    return bytes(sorted(holes[:index] + bytes((new_val,)) + holes[index + 1:]))
 
 
 def _log_new_global_best(holes, score):
-    """Append a line to best_holes_filename. Called while holding best_holes_lock."""
+    """Append a line to best_holes_filename, flock'd so concurrent workers don't interleave."""
     with open(best_holes_filename, "a") as fh:
-        fh.write(f"score: {score} holes: {'_'.join(map(str, holes))}\n")
-        fh.flush()
-        os.fsync(fh.fileno())
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            # single buffered write + flush; no fsync -- losing the very last
+            # line on a crash is acceptable, stalling every improvement is not
+            fh.write(f"score: {score} holes: {'_'.join(map(str, holes))}\n")
+            fh.flush()
+        finally:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
 
 
 def _maybe_update_global_best(candidate, cand_score):
-    """Update global best (and log) if candidate improves it. Must be called under lock."""
+    """Update this process's best (and log) if candidate improves it."""
     global best_holes, global_best_score
-    if global_best_score is None or cand_score < global_best_score:
-        best_holes = candidate.copy()
-        global_best_score = cand_score
-        _log_new_global_best(best_holes, global_best_score)
-        print(f"New global best: score={global_best_score} holes={best_holes}", flush=True)
+    if global_best_score is not None and cand_score >= global_best_score:
+        return
+    best_holes = candidate
+    global_best_score = cand_score
+    if _shared_best is not None:
+        # lock-free peek first: if another worker already found better, skip
+        # the cross-process lock and the file entirely (the read is racy, but
+        # only in the direction of an extra recheck under the lock)
+        if cand_score >= _shared_best.value:
+            return
+        with _shared_best.get_lock():
+            if cand_score >= _shared_best.value:
+                return
+            _shared_best.value = cand_score
+    _log_new_global_best(best_holes, global_best_score)
+    print(f"New global best: score={global_best_score} holes={tuple(best_holes)}", flush=True)
 
 
 def _run_until_frozen(holes, current_score, local_best_score, local_best_holes, heat, patience):
@@ -190,22 +353,29 @@ def _run_until_frozen(holes, current_score, local_best_score, local_best_holes,
         prev_local_best = local_best_score
         pass_no += 1
 
-        # do one full pass: test every hole
-        for idx in range(len(holes)):
-            candidate = change_hole(holes, idx)
-            cand_score = get_utilization(candidate)
+        # do one full pass: propose all holes up front and synthesize them
+        # concurrently, then fold in acceptance decisions in proposal order.
+        # Candidates are derived from the pass-entry holes, so later ones can
+        # be stale after an accept -- a small quality tradeoff for running
+        # yosys 13-wide instead of serially. The index order is shuffled so
+        # repeated passes don't always give the same holes first claim.
+        indices = list(range(len(holes)))
+        random.shuffle(indices)
+        candidates = [change_hole(holes, idx) for idx in indices]
+        scores = _get_eval_pool().map(get_utilization, candidates)
+        accepted_in_pass = 0
+        for candidate, cand_score in zip(candidates, scores):
             if cand_score is None:
                 cand_score = 10 ** 12
 
             # If candidate is a new local best or equal, always take it
             if cand_score <= local_best_score:
                 local_best_score = cand_score
-                local_best_holes = candidate.copy()
+                local_best_holes = candidate
                 holes = candidate
                 current_score = cand_score
-                # possibly update global best (under lock)
-                with best_holes_lock:
-                    _maybe_update_global_best(candidate, cand_score)
+                accepted_in_pass += 1
+                _maybe_update_global_best(candidate, cand_score)
                 continue
 
             # acceptance rules relative to current_score:
@@ -213,16 +383,22 @@ def _run_until_frozen(holes, current_score, local_best_score, local_best_holes,
                 # ALWAYS accept better (ignore heat)
                 holes = candidate
                 current_score = cand_score
+                accepted_in_pass += 1
             elif cand_score > current_score:
                 # worse: accept with probability heat
                 if random.random() < heat:
                     holes = candidate
                     current_score = cand_score
+                    accepted_in_pass += 1
             # equal to current_score: do nothing
 
         # end of full pass: decide whether to reset no_improve
         if local_best_score < prev_local_best:
             no_improve = 0
+        elif accepted_in_pass == 0:
+            # dead pass: nothing moved, so the next pass proposes from the
+            # same state; burn patience twice as fast to restart sooner
+            no_improve += 2
         else:
             no_improve += 1
 
@@ -244,20 +420,23 @@ def _run_fixed_iterations(holes, current_score, local_best_score, local_best_hol
     Returns updated (holes, current_score, local_best_score, local_best_holes).
     """
     for pass_no in range(1, iterations + 1):
-        for idx in range(len(holes)):
-            candidate = change_hole(holes, idx)
-            cand_score = get_utilization(candidate)
+        # same batched evaluation as _run_until_frozen: propose everything
+        # in shuffled order, synthesize concurrently, decide in order
+        indices = list(range(len(holes)))
+        random.shuffle(indices)
+        candidates = [change_hole(holes, idx) for idx in indices]
+        scores = _get_eval_pool().map(get_utilization, candidates)
+        for candidate, cand_score in zip(candidates, scores):
             if cand_score is None:
                 cand_score = 10 ** 12
 
             # If candidate <= local_best_score, always take and update local best
             if cand_score <= local_best_score:
                 local_best_score = cand_score
-                local_best_holes = candidate.copy()
+                local_best_holes = candidate
                 holes = candidate
                 current_score = cand_score
-                with best_holes_lock:
-                    _maybe_update_global_best(candidate, cand_score)
+                _maybe_update_global_best(candidate, cand_score)
                 continue
 
             if cand_score < current_score:
@@ -295,9 +474,9 @@ def monte_carlo(
     global best_holes, global_best_score
 
     if holes is None:
-        holes = sorted(random.sample(range(256), 13))
+        holes = bytes(sorted(random.sample(range(256), 13)))
     else:
-        holes = sorted(holes)
+        holes = bytes(sorted(holes))
 
     # initial evaluation
     current_score = get_utilization(holes)
@@ -305,29 +484,32 @@ def monte_carlo(
         current_score = 10 ** 12
 
     local_best_score = current_score
-    local_best_holes = holes.copy()
+    local_best_holes = holes
 
     # print(f"Starting monte_carlo: initial_score={current_score} holes={holes}", flush=True)
 
-    # print(f"Entering low-heat phase: heat={low_heat}, patience={low_heat_iterations}", flush=True)
-    holes, current_score, local_best_score, local_best_holes = _run_until_frozen(
-        holes, current_score, local_best_score, local_best_holes, low_heat, low_heat_iterations
-    )
-
-    for cycle in range(1, num_heat_cycles + 1):
-        # print(f"Cycle {cycle}/{num_heat_cycles}: switching to high heat={high_heat} for {high_heat_iterations} passes", flush=True)
-        # high heat: fixed iterations
-        holes, current_score, local_best_score, local_best_holes = _run_fixed_iterations(
-            holes, current_score, local_best_score, local_best_holes, high_heat, high_heat_iterations
-        )
-
-        # print(f"Cycle {cycle}/{num_heat_cycles}: switching back to low heat={low_heat} until frozen", flush=True)
-        # low heat until frozen
+    try:
+        # print(f"Entering low-heat phase: heat={low_heat}, patience={low_heat_iterations}", flush=True)
         holes, current_score, local_best_score, local_best_holes = _run_until_frozen(
             holes, current_score, local_best_score, local_best_holes, low_heat, low_heat_iterations
         )
 
-    print(f"Finished monte_carlo: local_best_score={local_best_score} local_best_holes={local_best_holes}", flush=True)
+        for cycle in range(1, num_heat_cycles + 1):
+            # print(f"Cycle {cycle}/{num_heat_cycles}: switching to high heat={high_heat} for {high_heat_iterations} passes", flush=True)
+            # high heat: fixed iterations
+            holes, current_score, local_best_score, local_best_holes = _run_fixed_iterations(
+                holes, current_score, local_best_score, local_best_holes, high_heat, high_heat_iterations
+            )
+
+            # print(f"Cycle {cycle}/{num_heat_cycles}: switching back to low heat={low_heat} until frozen", flush=True)
+            # low heat until frozen
+            holes, current_score, local_best_score, local_best_holes = _run_until_frozen(
+                holes, current_score, local_best_score, local_best_holes, low_heat, low_heat_iterations
+            )
+    finally:
+        _shutdown_eval_pool()
+
+    print(f"Finished monte_carlo: local_best_score={local_best_score} local_best_holes={tuple(local_best_holes)}", flush=True)
     return {"holes": local_best_holes, "score": local_best_score}
 
 
@@ -340,29 +522,36 @@ def main(
     high_heat_iterations=10,
     num_heat_cycles=1,
 ):
-    with ThreadPoolExecutor(max_workers=jobs) as ex:
-        futures = [
-            ex.submit(
-                monte_carlo,
-                None,
-                low_heat,
-                low_heat_iterations,
-                high_heat,
-                high_heat_iterations,
-                num_heat_cycles,
-            )
-            for _ in range(runs)
-        ]
-        for f in as_completed(futures):
-            try:
-                res = f.result()
-            except Exception as e:
-                print("Task failed:", e)
+    shared_best = multiprocessing.Value("q", _SHARED_BEST_INIT)
+    with multiprocessing.Manager() as manager:
+        shared_scores = manager.dict()
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_mc_worker,
+            initargs=(shared_best, shared_scores),
+        ) as ex:
+            futures = [
+                ex.submit(
+                    monte_carlo,
+                    None,
+                    low_heat,
+                    low_heat_iterations,
+                    high_heat,
+                    high_heat_iterations,
+                    num_heat_cycles,
+                )
+                for _ in range(runs)
+            ]
+            for f in as_completed(futures):
+                try:
+                    res = f.result()
+                except Exception as e:
+                    print("Task failed:", e)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Monte Carlo hole optimizer with heat cycles")
-    parser.add_argument("--jobs", type=int, default=4, help="number of concurrent threads")
+    parser.add_argument("--jobs", type=int, default=4, help="number of concurrent worker processes")
     parser.add_argument("--runs", type=int, default=8, help="total monte carlo runs to execute")
     parser.add_argument("--low-heat", type=float, default=0.1, help="low heat (accept worse with this probability)")
     parser.add_argument(
@@ -385,9 +574,16 @@ if __name__ == "__main__":
         help="number of high-heat -> low-heat cycles to perform after the initial low-heat freeze",
     )
     parser.add_argument("--best-file", type=str, default="best_holes.txt", help="file to store best holes")
+    parser.add_argument(
+        "--yosys-timeout",
+        type=float,
+        default=5.0,
+        help="seconds to wait for one yosys job before killing and respawning the shell",
+    )
     args = parser.parse_args()
 
     best_holes_filename = args.best_file
+    YOSYS_TIMEOUT = args.yosys_timeout
     main(
         jobs=args.jobs,
         runs=args.runs,